@@ -1,12 +1,65 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import altair as alt
 import io
-from sklearn.ensemble import IsolationForest
 
 st.set_page_config(page_title="Financial Report Generator", layout="centered")
 st.title("📊 Financial Report Generator")
 
+# Same reader as the KPI dashboard: calamine first, streamed openpyxl fallback
+def read_workbook(source):
+    try:
+        return pd.read_excel(source, engine='calamine', dtype_backend='pyarrow')
+    except ImportError:
+        return pd.read_excel(source, engine='openpyxl', dtype_backend='pyarrow')
+
+# Same date rule as the KPI dashboard: keep datetimes, parse mixed text per value
+def to_timestamps(column):
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    return pd.to_datetime(column, format='mixed', errors='coerce')
+
+# Amounts are one-dimensional, so anomalies are simply the tails: anything
+# beyond Tukey's far-out fences (3 × IQR outside the quartiles).
+def detect_anomalies(amounts):
+    q1, q3 = np.quantile(amounts, [0.25, 0.75])
+    iqr = q3 - q1
+    return (amounts < q1 - 3 * iqr) | (amounts > q3 + 3 * iqr)
+
+# Everything derived from the filters is cached on the data and filter values,
+# so reruns that leave them unchanged skip filtering, detection and grouping.
+@st.cache_data(show_spinner=False)
+def compute_views(data, selected_clients, date_range, amount_range):
+    # Apply filters
+    filtered_data = data[
+        (data['client_id'].isin(selected_clients)) &
+        (data['transaction_date'] >= pd.to_datetime(date_range[0])) &
+        (data['transaction_date'] <= pd.to_datetime(date_range[1])) &
+        (data['transaction_amount'] >= amount_range[0]) &
+        (data['transaction_amount'] <= amount_range[1])
+    ]
+
+    if len(filtered_data) >= 10:
+        is_anomaly = detect_anomalies(filtered_data['transaction_amount'].to_numpy(dtype=float))
+        filtered_data['anomaly'] = np.where(is_anomaly, 'Anomaly', 'Normal')
+    else:
+        filtered_data['anomaly'] = 'Not enough data'
+
+    summary = time_series = None
+    if {'client_id', 'transaction_amount', 'transaction_date'}.issubset(filtered_data.columns):
+        # Count anomalies by summing a precomputed flag, which keeps every
+        # aggregation on the built-in groupby path instead of a per-group lambda
+        is_anomaly = (filtered_data['anomaly'] == 'Anomaly').astype(np.int64)
+        summary = filtered_data.assign(is_anomaly=is_anomaly).groupby('client_id').agg(
+            transaction_amount=('transaction_amount', 'sum'),
+            transaction_date=('transaction_date', 'max'),
+            anomaly=('is_anomaly', 'sum'),
+        ).reset_index()
+        time_series = filtered_data.groupby('transaction_date')['transaction_amount'].sum().reset_index()
+
+    return filtered_data, summary, time_series
+
 # Upload section
 uploaded_file = st.file_uploader("Upload your financial data file (Excel or CSV)", type=["xlsx", "csv"])
 
@@ -16,7 +69,7 @@ if uploaded_file:
         if uploaded_file.name.endswith('.csv'):
             data = pd.read_csv(uploaded_file)
         else:
-            data = pd.read_excel(uploaded_file)
+            data = read_workbook(uploaded_file)
 
         st.success("✅ File uploaded successfully!")
 
@@ -26,14 +79,18 @@ if uploaded_file:
 
         # Clean data
         if 'transaction_date' in data.columns:
-            data['transaction_date'] = pd.to_datetime(data['transaction_date'], errors='coerce')
+            data['transaction_date'] = to_timestamps(data['transaction_date'])
         elif 'Date' in data.columns:
-            data['transaction_date'] = pd.to_datetime(data['Date'], errors='coerce')
+            data['transaction_date'] = to_timestamps(data['Date'])
 
+        # Cast to float first: Arrow-backed integer columns keep their int type
+        # through fillna, which would truncate the mean
         if 'transaction_amount' in data.columns:
-            data['transaction_amount'] = data['transaction_amount'].fillna(data['transaction_amount'].mean())
+            amounts = data['transaction_amount'].astype('float64')
+            data['transaction_amount'] = amounts.fillna(amounts.mean())
         elif 'Amount' in data.columns:
-            data['transaction_amount'] = data['Amount'].fillna(data['Amount'].mean())
+            amounts = data['Amount'].astype('float64')
+            data['transaction_amount'] = amounts.fillna(amounts.mean())
 
         data = data.drop_duplicates()
 
@@ -55,28 +112,16 @@ if uploaded_file:
         max_amount = float(data['transaction_amount'].max())
         amount_range = st.slider("Select Transaction Amount Range", min_value=min_amount, max_value=max_amount, value=(min_amount, max_amount))
 
-        # Apply filters
-        filtered_data = data[
-            (data['client_id'].isin(selected_clients)) &
-            (data['transaction_date'] >= pd.to_datetime(date_range[0])) &
-            (data['transaction_date'] <= pd.to_datetime(date_range[1])) &
-            (data['transaction_amount'] >= amount_range[0]) &
-            (data['transaction_amount'] <= amount_range[1])
-        ]
+        filtered_data, summary, time_series = compute_views(data, selected_clients, date_range, amount_range)
 
         # ---------------------- ANOMALY DETECTION ----------------------
         st.markdown("---")
         st.subheader("🚨 Anomaly Detection")
 
-        model = IsolationForest(n_estimators=100, contamination=0.01, random_state=42)
         if len(filtered_data) >= 10:
-            filtered_data['anomaly'] = model.fit_predict(filtered_data[['transaction_amount']])
-            filtered_data['anomaly'] = filtered_data['anomaly'].apply(lambda x: 'Anomaly' if x == -1 else 'Normal')
-
             num_anomalies = (filtered_data['anomaly'] == 'Anomaly').sum()
             st.metric("Detected Anomalies", value=f"{num_anomalies}")
         else:
-            filtered_data['anomaly'] = 'Not enough data'
             st.warning("⚠️ Not enough data for anomaly detection (need at least 10 records).")
 
         st.markdown("---")
@@ -84,13 +129,7 @@ if uploaded_file:
         st.dataframe(filtered_data.head(10))
 
         # ---------------------- SUMMARY SECTION ----------------------
-        if {'client_id', 'transaction_amount', 'transaction_date'}.issubset(filtered_data.columns):
-            summary = filtered_data.groupby('client_id').agg({
-                'transaction_amount': 'sum',
-                'transaction_date': 'max',
-                'anomaly': lambda x: (x == 'Anomaly').sum() if 'Anomaly' in x.values else 0
-            }).reset_index()
-
+        if summary is not None:
             st.subheader("📈 Client Summary Table")
             st.dataframe(summary)
 
@@ -117,7 +156,6 @@ if uploaded_file:
                 tooltip=['client_id', 'transaction_amount']
             ).properties(title='Total Transaction Amount per Client')
 
-            time_series = filtered_data.groupby('transaction_date')['transaction_amount'].sum().reset_index()
             line_chart = alt.Chart(time_series).mark_line(point=True).encode(
                 x=alt.X('transaction_date:T', title='Date'),
                 y=alt.Y('transaction_amount:Q', title='Total Amount'),
@@ -150,7 +188,7 @@ if uploaded_file:
             @st.cache_data
             def convert_df(df):
                 output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
+                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
                     df.to_excel(writer, index=False, sheet_name='Summary')
                 processed_data = output.getvalue()
                 return processed_data
@@ -2,10 +2,7 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 from io import BytesIO
-from datetime import datetime
-import openai
-import os
-from fpdf import FPDF
+import re
 
 # ✅ MUST be the first Streamlit command
 st.set_page_config(page_title="NovaFi | Financial Insights Dashboard", layout="wide")
@@ -37,43 +34,152 @@ st.title("🌟 NovaFi: Financial Insights Dashboard")
 # --- File Upload ---
 uploaded_files = st.file_uploader("Upload your financial statements (GL, P&L, BS - Excel format)", type=["xlsx"], accept_multiple_files=True)
 
-gl_data = pd.DataFrame()
-pnl_data = pd.DataFrame()
-bs_data = pd.DataFrame()
+# Prefer the Rust calamine reader; without python-calamine fall back to
+# openpyxl, which pandas opens in read-only mode so rows are streamed rather
+# than held as a full grid of cell objects.
+def read_workbook(source):
+    try:
+        return pd.read_excel(source, engine='calamine', dtype_backend='pyarrow')
+    except ImportError:
+        return pd.read_excel(source, engine='openpyxl', dtype_backend='pyarrow')
+
+# Whole columns of Excel date cells arrive as datetimes and skip parsing;
+# a column mixing date cells and text dates arrives as strings and needs
+# format='mixed' so each value is parsed on its own
+def to_timestamps(column):
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    return pd.to_datetime(column, format='mixed', errors='coerce')
+
+# Keywords that mark a statement as a P&L or a balance sheet, matched against
+# lowercased account names.
+STATEMENT_PATTERN = re.compile(r"income|expense|cogs|assets|liabilities|equity")
+PNL_KEYWORDS = {"income", "expense", "cogs"}
+BS_KEYWORDS = {"assets", "liabilities", "equity"}
+
+# Parsing is cached on the file bytes, so reruns triggered by other widgets
+# reuse the cleaned frames instead of re-reading every workbook.
+@st.cache_data(show_spinner=False)
+def parse_statement(raw_bytes, name):
+    df = read_workbook(BytesIO(raw_bytes))
+    df.columns = df.columns.str.strip()
+
+    # Amounts are made numeric here, inside the cache, so KPI code never
+    # re-coerces. Account stays an Arrow string column: per-file categoricals
+    # with different categories degrade to plain strings when concatenated.
+    if 'Date' in df.columns and 'Account' in df.columns and 'Amount' in df.columns:
+        df['Date'] = to_timestamps(df['Date'])
+        df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
+        df = df.dropna(subset=['Date', 'Account', 'Amount'])
+        return "gl", df
+    if 'Account' in df.columns and ('Total' in df.columns or 'Amount' in df.columns):
+        df['Amount'] = df['Amount'] if 'Amount' in df.columns else df['Total']
+        # One scan over the distinct names collects every keyword present
+        keywords = {
+            keyword
+            for account in df['Account'].str.lower().dropna().unique()
+            for keyword in STATEMENT_PATTERN.findall(account)
+        }
+        if keywords & PNL_KEYWORDS:
+            kind = "pnl"
+        elif keywords & BS_KEYWORDS:
+            kind = "bs"
+        else:
+            return None, df
+        df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
+        return kind, df
+    return "unknown", df
+
+gl_parts, pnl_parts, bs_parts = [], [], []
 
 if uploaded_files:
     for file in uploaded_files:
         try:
-            df = pd.read_excel(file)
-            df.columns = df.columns.str.strip()
-
-            if 'Date' in df.columns and 'Account' in df.columns and 'Amount' in df.columns:
-                df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-                df = df.dropna(subset=['Date', 'Account', 'Amount'])
-                gl_data = pd.concat([gl_data, df], ignore_index=True)
-            elif 'Account' in df.columns and ('Total' in df.columns or 'Amount' in df.columns):
-                df['Amount'] = df['Amount'] if 'Amount' in df.columns else df['Total']
-                if df['Account'].str.contains("Income|Expense|COGS", case=False).any():
-                    pnl_data = pd.concat([pnl_data, df], ignore_index=True)
-                elif df['Account'].str.contains("Assets|Liabilities|Equity", case=False).any():
-                    bs_data = pd.concat([bs_data, df], ignore_index=True)
-            else:
+            kind, df = parse_statement(file.getvalue(), file.name)
+            if kind == "gl":
+                gl_parts.append(df)
+            elif kind == "pnl":
+                pnl_parts.append(df)
+            elif kind == "bs":
+                bs_parts.append(df)
+            elif kind == "unknown":
                 st.warning(f"⚠️ Unknown format in {file.name}, skipping.")
         except Exception as e:
             st.error(f"❌ Error processing {file.name}: {e}")
 
+# Concatenate once per statement type instead of re-copying on every file
+gl_data = pd.concat(gl_parts, ignore_index=True) if gl_parts else pd.DataFrame()
+pnl_data = pd.concat(pnl_parts, ignore_index=True) if pnl_parts else pd.DataFrame()
+bs_data = pd.concat(bs_parts, ignore_index=True) if bs_parts else pd.DataFrame()
+
 # --- KPI Calculations ---
+# Account buckets as bit flags, so a name like "Income Tax Expense" still counts
+# toward every KPI whose keyword it contains.
+INCOME = 1
+EXPENSE = 2
+COGS = 4
+ASSETS = 8
+LIABILITIES = 16
+EQUITY = 32
+CURRENT_ASSETS = 64
+CURRENT_LIABILITIES = 128
+NUM_BUCKETS = 256  # every combination of the eight flags
+BUCKET_IDS = np.arange(NUM_BUCKETS)
+
+# One alternation instead of a str.contains scan per KPI, matched against
+# lowercased names. Longer keywords come first so "Current Assets" is tagged
+# as both current and total assets.
+ACCOUNT_PATTERN = re.compile(
+    r"(?P<income>income)"
+    r"|(?P<cogs>cost of goods sold)"
+    r"|(?P<expense>expense)"
+    r"|(?P<current_assets>current assets)"
+    r"|(?P<current_liabilities>current liabilities)"
+    r"|(?P<assets>assets)"
+    r"|(?P<liabilities>liabilities)"
+    r"|(?P<equity>equity)"
+)
+ACCOUNT_FLAGS = {
+    "income": INCOME,
+    "cogs": COGS | EXPENSE,
+    "expense": EXPENSE,
+    "current_assets": CURRENT_ASSETS | ASSETS,
+    "current_liabilities": CURRENT_LIABILITIES | LIABILITIES,
+    "assets": ASSETS,
+    "liabilities": LIABILITIES,
+    "equity": EQUITY,
+}
+
+def classify_account(account):
+    if not isinstance(account, str):
+        return 0
+    flags = 0
+    for match in ACCOUNT_PATTERN.finditer(account.lower()):
+        flags |= ACCOUNT_FLAGS[match.lastgroup]
+    return flags
+
+def bucket_totals(df):
+    # Classify each distinct account once and broadcast through the factorized
+    # codes; missing accounts have code -1 and land on the trailing 0 entry.
+    codes, names = pd.factorize(df['Account'])
+    name_flags = np.array([classify_account(name) for name in names], dtype=np.uint8)
+    row_flags = np.append(name_flags, 0)[codes]
+    amounts = df['Amount'].fillna(0).to_numpy(dtype=np.float64)
+    return np.bincount(row_flags, weights=amounts, minlength=NUM_BUCKETS)
+
+def flag_total(totals, flag):
+    return totals[(BUCKET_IDS & flag) != 0].sum()
+
+@st.cache_data(show_spinner=False)
 def calculate_kpis(gl_data, pnl_data, bs_data):
     kpis = {}
 
-    if not gl_data.empty:
-        total_revenue = gl_data[gl_data['Account'].str.contains("Income", case=False)]['Amount'].sum()
-        total_expenses = gl_data[gl_data['Account'].str.contains("Expense|Cost of Goods Sold", case=False)]['Amount'].sum()
-        cogs = gl_data[gl_data['Account'].str.contains("Cost of Goods Sold", case=False)]['Amount'].sum()
-    elif not pnl_data.empty:
-        total_revenue = pnl_data[pnl_data['Account'].str.contains("Income", case=False)]['Amount'].sum()
-        total_expenses = pnl_data[pnl_data['Account'].str.contains("Expense|Cost of Goods Sold", case=False)]['Amount'].sum()
-        cogs = pnl_data[pnl_data['Account'].str.contains("Cost of Goods Sold", case=False)]['Amount'].sum()
+    income_data = gl_data if not gl_data.empty else pnl_data
+    if not income_data.empty:
+        totals = bucket_totals(income_data)
+        total_revenue = flag_total(totals, INCOME)
+        total_expenses = flag_total(totals, EXPENSE)
+        cogs = flag_total(totals, COGS)
     else:
         total_revenue = total_expenses = cogs = 0
 
@@ -82,12 +188,16 @@ def calculate_kpis(gl_data, pnl_data, bs_data):
     gross_margin = gross_profit / total_revenue if total_revenue else 0
     net_margin = net_income / total_revenue if total_revenue else 0
 
-    total_assets = bs_data[bs_data['Account'].str.contains("Assets", case=False)]['Amount'].sum() if not bs_data.empty else 0
-    total_equity = bs_data[bs_data['Account'].str.contains("Equity", case=False)]['Amount'].sum() if not bs_data.empty else 0
-    total_liabilities = bs_data[bs_data['Account'].str.contains("Liabilities", case=False)]['Amount'].sum() if not bs_data.empty else 0
-
-    current_assets = bs_data[bs_data['Account'].str.contains("Current Assets", case=False)]['Amount'].sum() if not bs_data.empty else 0
-    current_liabilities = bs_data[bs_data['Account'].str.contains("Current Liabilities", case=False)]['Amount'].sum() if not bs_data.empty else 0
+    if not bs_data.empty:
+        totals = bucket_totals(bs_data)
+        total_assets = flag_total(totals, ASSETS)
+        total_equity = flag_total(totals, EQUITY)
+        total_liabilities = flag_total(totals, LIABILITIES)
+        current_assets = flag_total(totals, CURRENT_ASSETS)
+        current_liabilities = flag_total(totals, CURRENT_LIABILITIES)
+    else:
+        total_assets = total_equity = total_liabilities = 0
+        current_assets = current_liabilities = 0
 
     kpis = {
         "Total Revenue": total_revenue,
@@ -106,56 +216,82 @@ def calculate_kpis(gl_data, pnl_data, bs_data):
     }
     return kpis
 
+def format_kpi(metric, value):
+    if "Margin" in metric or "Ratio" in metric or "Return" in metric:
+        return f"{value:.2%}"
+    return f"${value:,.2f}"
+
 if not gl_data.empty or not pnl_data.empty or not bs_data.empty:
     kpis = calculate_kpis(gl_data, pnl_data, bs_data)
+    # A tuple of (metric, value) pairs is cheaper for the cache to hash than a dict
+    kpi_items = tuple(kpis.items())
 
+    # One table element instead of a separate st.metric message per KPI
     st.subheader("📈 Key Financial Metrics")
-    for metric, value in kpis.items():
-        if "Margin" in metric or "Ratio" in metric or "Return" in metric:
-            st.metric(metric, f"{value:.2%}")
-        else:
-            st.metric(metric, f"${value:,.2f}")
+    kpi_table = pd.DataFrame({
+        "Metric": [metric for metric, _ in kpi_items],
+        "Value": [format_kpi(metric, value) for metric, value in kpi_items],
+    })
+    st.dataframe(kpi_table, hide_index=True, width='stretch')
 
     # --- Export KPIs to Excel ---
+    # Rows are written straight to xlsxwriter without a DataFrame in between;
+    # in_memory keeps the small sheet off temp files while the xlsx is zipped.
     @st.cache_data
-    def export_kpis_to_excel(kpis):
-        df = pd.DataFrame(kpis.items(), columns=["Metric", "Value"])
+    def export_kpis_to_excel(items):
+        import xlsxwriter
+
         output = BytesIO()
-        df.to_excel(output, index=False, engine='openpyxl')
-        output.seek(0)
-        return output
-
-    kpi_excel = export_kpis_to_excel(kpis)
-    st.download_button(
-        label="📥 Download KPI Excel Report",
-        data=kpi_excel,
-        file_name="nova_kpis.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+        worksheet = workbook.add_worksheet('Summary')
+        worksheet.write_row(0, 0, ["Metric", "Value"])
+        for row, (metric, value) in enumerate(items, start=1):
+            worksheet.write_row(row, 0, [metric, value])
+        workbook.close()
+        return output.getvalue()
+
+    # Reports are only built once asked for. The session remembers which KPIs
+    # the report was prepared for, so the download stays on reruns that leave
+    # them unchanged and any KPI change asks for a fresh click.
+    if st.button("Prepare KPI Excel Report"):
+        st.session_state["excel_for"] = kpi_items
+    if st.session_state.get("excel_for") == kpi_items:
+        kpi_excel = export_kpis_to_excel(kpi_items)
+        st.download_button(
+            label="📥 Download KPI Excel Report",
+            data=kpi_excel,
+            file_name="nova_kpis.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
 
     # --- PDF Report ---
-    def generate_pdf_summary(kpis):
+    @st.cache_data
+    def generate_pdf_summary(items):
+        from fpdf import FPDF
+
         pdf = FPDF()
         pdf.add_page()
-        pdf.set_font("Arial", size=14)
-        pdf.cell(200, 10, txt="NovaFi KPI Summary Report", ln=1, align='C')
-        pdf.set_font("Arial", size=12)
+        pdf.set_font("Helvetica", size=14)
+        pdf.cell(200, 10, text="NovaFi KPI Summary Report", new_x="LMARGIN", new_y="NEXT", align='C')
+        pdf.set_font("Helvetica", size=12)
         pdf.ln(10)
 
-        for metric, value in kpis.items():
-            val = f"{value:.2%}" if "Margin" in metric or "Ratio" in metric or "Return" in metric else f"${value:,.2f}"
-            pdf.cell(200, 10, txt=f"{metric}: {val}", ln=1)
+        # One layout pass over the whole body instead of a cell per KPI
+        body = "\n".join(f"{metric}: {format_kpi(metric, value)}" for metric, value in items)
+        pdf.multi_cell(0, 10, body)
 
-        pdf_output = pdf.output(dest='S').encode('latin1')
-        return BytesIO(pdf_output)
+        return bytes(pdf.output())
 
-    kpi_pdf = generate_pdf_summary(kpis)
-    st.download_button(
-        label="📄 Download KPI PDF Report",
-        data=kpi_pdf,
-        file_name="nova_kpis_report.pdf",
-        mime="application/pdf"
-    )
+    if st.button("Prepare KPI PDF Report"):
+        st.session_state["pdf_for"] = kpi_items
+    if st.session_state.get("pdf_for") == kpi_items:
+        kpi_pdf = generate_pdf_summary(kpi_items)
+        st.download_button(
+            label="📄 Download KPI PDF Report",
+            data=kpi_pdf,
+            file_name="nova_kpis_report.pdf",
+            mime="application/pdf"
+        )
 
 else:
     st.info("📤 Upload one or more Excel files (GL, P&L, or BS) to begin analysis.")
@@ -7,10 +7,12 @@ data = pd.DataFrame({
     'transaction_date': ['2025-03-01', '2025-03-02', '2025-03-01', '2025-03-03', '2025-03-02', '2025-03-04', '2025-03-05']
 })
 
-# Clean data
-data['transaction_date'] = pd.to_datetime(data['transaction_date'])
-data['transaction_amount'].fillna(data['transaction_amount'].mean(), inplace=True)
-data = data.drop_duplicates()
+# Clean data (assigned back rather than filled in place, which is a no-op
+# on a column under copy-on-write)
+data = data.assign(
+    transaction_date=pd.to_datetime(data['transaction_date']),
+    transaction_amount=data['transaction_amount'].fillna(data['transaction_amount'].mean()),
+).drop_duplicates()
 
 # Aggregate data
 summary = data.groupby('client_id').agg({
@@ -19,6 +21,6 @@ summary = data.groupby('client_id').agg({
 }).reset_index()
 
 # Save to Excel
-summary.to_excel('client_summary.xlsx', index=False)
+summary.to_excel('client_summary.xlsx', index=False, engine='xlsxwriter')
 
 print("✅ Financial summary report generated successfully!")
\ No newline at end of file